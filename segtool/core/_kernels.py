@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import numpy as np
+
+# Numba is optional: when it is missing every kernel falls back to plain NumPy.
+try:
+    from numba import njit
+except Exception:  # pragma: no cover
+    njit = None
+
+HAVE_NUMBA = njit is not None
+
+# OpenCV (already an optional SAM dependency) provides SIMD kernels for the
+# normalize and overlay steps; NumPy is used when it is not installed.
+try:
+    import cv2
+except Exception:  # pragma: no cover
+    cv2 = None
+
+HAVE_CV2 = cv2 is not None
+
+
+if HAVE_NUMBA:
+
+    # fastmath without "nnan"/"ninf": NaN voxels must still map to 0.
+    # nogil so the slice prefetch threads can normalize concurrently with the UI thread.
+    # Deliberately serial: it is called from the UI, prefetch and SAM threads at once,
+    # and numba's default "workqueue" layer aborts on concurrent parallel launches.
+    # The prefetch pool already provides the parallelism.
+    @njit(nogil=True, fastmath={"nsz", "arcp", "contract", "afn", "reassoc"}, cache=True)
+    def _norm_u8_kernel(a, vmin, vmax, out):  # pragma: no cover - compiled
+        inv = np.float32(255.0 / (vmax - vmin))
+        lo = np.float32(vmin)
+        for i in range(a.shape[0]):
+            for j in range(a.shape[1]):
+                v = (a[i, j] - lo) * inv
+                if v >= 255.0:
+                    out[i, j] = 255
+                elif v > 0.0:
+                    out[i, j] = np.uint8(v)
+                else:
+                    out[i, j] = 0
+
+    # One 2D slice is too little work to amortize a thread launch; serial like _norm_u8_kernel.
+    @njit(nogil=True, cache=True)
+    def _paint_label_kernel(dst, where, label):  # pragma: no cover - compiled
+        for i in range(dst.shape[0]):
+            for j in range(dst.shape[1]):
+                if where[i, j]:
+                    dst[i, j] = label
+
+
+def norm_u8(a: np.ndarray, vmin: float, vmax: float) -> np.ndarray:
+    """
+    Fused (a - vmin) / (vmax - vmin) -> clip [0,1] -> *255 -> uint8 for a 2D float32 array.
+    Requires vmax > vmin.
+    """
+    if HAVE_NUMBA and a.ndim == 2:
+        out = np.empty(a.shape, dtype=np.uint8)
+        _norm_u8_kernel(a, np.float32(vmin), np.float32(vmax), out)
+        return out
+
+    if HAVE_CV2:
+        # convertScaleAbs takes |x|, so clamp below at vmin first; it saturates at 255.
+        scale = 255.0 / (vmax - vmin)
+        lifted = cv2.max(np.ascontiguousarray(a), float(vmin))
+        return cv2.convertScaleAbs(lifted, alpha=scale, beta=-vmin * scale)
+
+    # NumPy fallback: one float32 scratch buffer reused in place for every step
+    tmp = np.subtract(a, np.float32(vmin), dtype=np.float32)
+    np.multiply(tmp, np.float32(255.0 / (vmax - vmin)), out=tmp)
+    np.clip(tmp, 0.0, 255.0, out=tmp)
+    return tmp.astype(np.uint8)
+
+
+def paint_label(dst: np.ndarray, where: np.ndarray, label: int) -> None:
+    """
+    dst[where] = label, in place. dst: (H,W) uint8 (may be a strided view); where: (H,W) bool.
+    """
+    # the numba kernel does no bounds checking, so a mismatched mask must be rejected here
+    if where.shape != dst.shape:
+        raise ValueError(f"mask shape {where.shape} does not match slice shape {dst.shape}")
+    if HAVE_NUMBA and dst.ndim == 2:
+        _paint_label_kernel(dst, where, np.uint8(label))
+        return
+    np.copyto(dst, np.uint8(label), where=where)
+
+
+def overlay_u8(base_u8: np.ndarray, label_mask_u8: np.ndarray, color_lut: np.ndarray, alpha: float) -> np.ndarray:
+    """
+    Blend color_lut[label] over the grayscale base where label != 0.
+    base_u8, label_mask_u8: (H,W) uint8; color_lut: (256,3) uint8; returns (H,W,3) uint8.
+    """
+    base_u8 = np.ascontiguousarray(base_u8, dtype=np.uint8)
+    mask = np.ascontiguousarray(label_mask_u8, dtype=np.uint8)
+
+    if HAVE_CV2:
+        out = cv2.cvtColor(base_u8, cv2.COLOR_GRAY2RGB)
+        colors = cv2.LUT(cv2.cvtColor(mask, cv2.COLOR_GRAY2RGB), color_lut.reshape(256, 1, 3))
+        blended = cv2.addWeighted(out, 1.0 - alpha, colors, alpha, 0.0)
+        cv2.copyTo(blended, mask, out)
+        return out
+
+    # Only labelled pixels are blended: one gather from the color table and a
+    # fixed-point (8 fractional bits) blend, instead of one full scan per label.
+    w = int(round(alpha * 256.0))
+    out = np.repeat(base_u8[..., None], 3, axis=-1)
+    flat = out.reshape(-1, 3)
+    sel = np.flatnonzero(mask)
+    vals = mask.ravel()[sel]
+    # in-place uint16 arithmetic; the final assignment casts back to uint8 without a temporary
+    blended = flat[sel].astype(np.uint16)
+    blended *= 256 - w
+    colors = color_lut[vals].astype(np.uint16)
+    colors *= w
+    blended += colors
+    blended >>= 8
+    flat[sel] = blended
+    return out
@@ -1,54 +1,73 @@
 from __future__ import annotations
 
+from typing import Optional
+
 import numpy as np
 
+from ._kernels import norm_u8, overlay_u8
+
+
+def robust_range(a: np.ndarray, lo: float = 1.0, hi: float = 99.0) -> Optional[tuple[float, float]]:
+    """
+    (lo, hi) percentiles of the finite values of `a`, using np.partition (O(N) selection).
+    Falls back to (min, max) if the percentiles collapse; None if there is no usable range.
+    """
+    a = np.asarray(a)
+    vals = a.astype(np.float32, copy=False).ravel()
+    # Integer data is always finite; for floats only build the mask when needed.
+    if a.dtype.kind == "f" and not np.isfinite(vals).all():
+        vals = vals[np.isfinite(vals)]
+    n = vals.size
+    if n == 0:
+        return None
+
+    k_lo = min(n - 1, max(0, int(lo / 100.0 * n)))
+    k_hi = min(n - 1, max(0, int(hi / 100.0 * n)))
+    part = np.partition(vals, (k_lo, k_hi))
+    vmin = float(part[k_lo])
+    vmax = float(part[k_hi])
+    if vmax <= vmin:
+        vmin = float(part.min())
+        vmax = float(part.max())
+        if vmax <= vmin:
+            return None
+    return vmin, vmax
+
 
-def normalize_to_uint8(img2d: np.ndarray) -> np.ndarray:
+def normalize_to_uint8(img2d: np.ndarray, vrange: Optional[tuple[float, float]] = None) -> np.ndarray:
     """
     Normalize a 2D array to uint8 [0,255] using robust percentiles.
+    vrange: optional precomputed (vmin, vmax), e.g. from NiftiVolume.slice_range.
     """
+    if vrange is None:
+        vrange = robust_range(img2d)
     a = np.asarray(img2d, dtype=np.float32)
-    if not np.isfinite(a).any():
+    if vrange is None:
         return np.zeros_like(a, dtype=np.uint8)
 
-    vmin = np.nanpercentile(a, 1.0)
-    vmax = np.nanpercentile(a, 99.0)
-    if vmax <= vmin:
-        vmin = float(np.nanmin(a))
-        vmax = float(np.nanmax(a))
-        if vmax <= vmin:
-            return np.zeros_like(a, dtype=np.uint8)
+    vmin, vmax = vrange
+    return _scale_to_uint8(a, vmin, vmax)
 
-    a = (a - vmin) / (vmax - vmin)
-    a = np.clip(a, 0.0, 1.0)
-    return (a * 255.0).astype(np.uint8)
+
+def _scale_to_uint8(a: np.ndarray, vmin: float, vmax: float) -> np.ndarray:
+    if vmax <= vmin:
+        return np.zeros_like(a, dtype=np.uint8)
+    return norm_u8(a, vmin, vmax)
 
 
 def compose_overlay_rgb(
     base_u8: np.ndarray,
     label_mask_u8: np.ndarray | None,
-    label_to_rgb: dict[int, tuple[int, int, int]],
+    label_lut: np.ndarray,
     alpha: float = 0.4,
 ) -> np.ndarray:
     """
     base_u8: (H,W) uint8
     label_mask_u8: (H,W) uint8 values 0..N
-    returns: (H,W,3) uint8
+    label_lut: (256,3) uint8 color table indexed by label value (see labels.LABEL_LUT)
+    returns: (H,W,3) uint8, or base_u8 itself (H,W) when there is nothing to overlay
     """
-    base = np.stack([base_u8, base_u8, base_u8], axis=-1).astype(np.float32)
-    if label_mask_u8 is None:
-        return base.astype(np.uint8)
-
-    out = base
-    m = label_mask_u8.astype(np.uint8)
-    for val, rgb in label_to_rgb.items():
-        if val == 0:
-            continue
-        sel = m == val
-        if not np.any(sel):
-            continue
-        color = np.array(rgb, dtype=np.float32).reshape(1, 1, 3)
-        out[sel] = out[sel] * (1.0 - alpha) + color * alpha
-
-    return np.clip(out, 0, 255).astype(np.uint8)
+    if label_mask_u8 is None or not label_mask_u8.any():
+        return base_u8
 
+    return overlay_u8(base_u8, label_mask_u8, label_lut, float(np.clip(alpha, 0.0, 1.0)))
@@ -2,6 +2,8 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 
+import numpy as np
+
 
 @dataclass(frozen=True)
 class LabelSpec:
@@ -33,3 +35,13 @@ LABELS: dict[str, LabelSpec] = {
     "aqua": LabelSpec(value=18, name="Aqua", color_name="aqua", rgb=(0, 255, 127)),
 }
 
+
+# 渲染用查找表，导入时构建一次
+LABEL_VALUE_TO_RGB: dict[int, tuple[int, int, int]] = {spec.value: spec.rgb for spec in LABELS.values()}
+
+# (256,3) uint8，按 mask 值索引颜色（0 为背景）
+LABEL_LUT = np.zeros((256, 3), dtype=np.uint8)
+for _spec in LABELS.values():
+    LABEL_LUT[_spec.value] = _spec.rgb
+del _spec
+LABEL_LUT.setflags(write=False)
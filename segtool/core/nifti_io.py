@@ -1,12 +1,21 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
 from enum import Enum
 from pathlib import Path
 from typing import Literal, Optional
 
 import nibabel as nib
 import numpy as np
+from nibabel.openers import Opener
+
+from .image_utils import robust_range
+
+# 后台线程：加载后预计算每张切片的显示窗位 (1%/99% 分位数)；
+# 体数据被替换/清除或程序退出时通过 NiftiVolume.cancel_background 取消，避免退出时等待整轮计算
+_PERCENTILE_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="segtool-percentiles")
 
 
 class ViewOrientation(str, Enum):
@@ -19,14 +28,66 @@ class ViewOrientation(str, Enum):
 @dataclass
 class NiftiVolume:
     path: Path
-    data: np.ndarray  # float/integers, shape: (H,W) or (H,W,Z) (we support 2D/3D)
+    data: np.ndarray  # float/integers (may be a memmap), shape: (H,W) or (H,W,Z) (we support 2D/3D)
     affine: np.ndarray
     header: nib.Nifti1Header
+    # orientation -> (num_slices, 2) float32 of (vmin, vmax); NaN rows have no usable range
+    _percentiles: dict[ViewOrientation, np.ndarray] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _percentile_future: Optional[Future] = field(default=None, init=False, repr=False, compare=False)
+    _percentile_cancel: threading.Event = field(
+        default_factory=threading.Event, init=False, repr=False, compare=False
+    )
 
     @property
     def is_3d(self) -> bool:
         return self.data.ndim == 3
 
+    def precompute_percentiles(self) -> None:
+        """为每个方向的每张切片计算 (vmin, vmax)，供 normalize_to_uint8 直接使用
+
+        默认显示的横断面最先计算；每张切片之间检查取消标志（见 cancel_background）。
+        """
+        if self.data.ndim != 3:
+            return
+        # 切片的分位数与显示时的旋转/翻转无关，只取决于固定的轴
+        axes = {
+            ViewOrientation.AXIAL: 2,
+            ViewOrientation.CORONAL: 1,
+            ViewOrientation.SAGITTAL: 0,
+        }
+        for orientation, axis in axes.items():
+            n = int(self.data.shape[axis])
+            table = np.full((n, 2), np.nan, dtype=np.float32)
+            for i in range(n):
+                if self._percentile_cancel.is_set():
+                    return
+                rng = robust_range(np.take(self.data, i, axis=axis))
+                if rng is not None:
+                    table[i] = rng
+            # 整张表算完后再发布，读取方不会看到半成品
+            self._percentiles[orientation] = table
+
+    def cancel_background(self) -> None:
+        """停止后台分位数计算：未开始的任务直接取消，正在运行的在下一张切片处返回"""
+        self._percentile_cancel.set()
+        if self._percentile_future is not None:
+            self._percentile_future.cancel()
+
+    def slice_range(
+        self, idx: int, orientation: ViewOrientation = ViewOrientation.AXIAL
+    ) -> Optional[tuple[float, float]]:
+        """返回预计算的 (vmin, vmax)；尚未算好或无有效范围时返回 None"""
+        table = self._percentiles.get(orientation)
+        if table is None:
+            return None
+        idx = int(np.clip(idx, 0, table.shape[0] - 1))
+        vmin, vmax = table[idx]
+        if not np.isfinite(vmin) or not np.isfinite(vmax):
+            return None
+        return float(vmin), float(vmax)
+
     def num_slices(self, orientation: ViewOrientation = ViewOrientation.AXIAL) -> int:
         """获取指定方向的切片数量"""
         if self.data.ndim == 2:
@@ -41,6 +102,9 @@ class NiftiVolume:
     def get_slice(self, idx: int, orientation: ViewOrientation = ViewOrientation.AXIAL) -> np.ndarray:
         """获取指定方向和索引的切片
         
+        返回 data 的视图（负步长、非连续，类型与 data 相同，调用方不应修改），不做拷贝；
+        需要连续内存或 float32 的调用方（如 normalize_to_uint8）自行转换一次。
+
         Args:
             idx: 切片索引
             orientation: 显示方向 (axial/coronal/sagittal)
@@ -48,69 +112,66 @@ class NiftiVolume:
         if self.data.ndim == 2:
             return self.data
         
+        # 每个方向的旋转/翻转合并成一次切片视图
         if orientation == ViewOrientation.AXIAL:
-            # 横断面: data[:, :, idx] - 显示 H×W
-            # 需要旋转使后背向下（用户说后背向右但应该向下）
+            # 横断面: data[:, :, idx] (H, W)，顺时针旋转90度使后背向下
+            # rot90(k=-1) == 转置后左右翻转
             idx = int(np.clip(idx, 0, self.data.shape[2] - 1))
-            slice_2d = self.data[:, :, idx]  # (H, W)
-            # 顺时针旋转90度使后背向下
-            rotated = np.rot90(slice_2d, k=-1)
-            return rotated
+            view = self.data[:, :, idx].T[:, ::-1]
         elif orientation == ViewOrientation.CORONAL:
-            # 冠状面：应该显示 (上下=Z, 前后=H)
-            # 用户说方向是对的但上下被压缩，说明Z应该在垂直方向且是长边
+            # 冠状面: data[:, idx, :] (H, Z) = (前后, 上下)
+            # 转置使Z在垂直方向 (Z, H)，再上下翻转 == 先沿Z反向再转置
             idx = int(np.clip(idx, 0, self.data.shape[1] - 1))  # 固定左右方向
-            slice_2d = self.data[:, idx, :]  # (H, Z) = (前后, 上下)
-            # 转置使Z在垂直方向：(Z, H) = (上下, 前后)
-            transposed = slice_2d.T
-            # 如果转置后高度 < 宽度，说明垂直方向（Z）被压缩了
-            # 需要旋转使垂直方向成为长边，但保持Z轴在垂直方向
-            # 如果 (Z, H) = (231, 512)，高度 < 宽度，需要让高度成为长边
-            # 旋转90度得到 (H, Z) = (512, 231)，但这样Z不在垂直
-            # 用户说方向是对的，所以可能是数据本身的问题，或者需要不同的处理
-            
-            # 保持Z在垂直方向
-            rotated = transposed
-            # 上下翻转以修正方向
-            flipped = np.flipud(rotated)
-            return flipped
+            view = self.data[:, idx, ::-1].T
         else:  # SAGITTAL
-            # 矢状面：应该显示 (上下=Z, 左右=W)
+            # 矢状面: data[idx, :, :] (W, Z) = (左右, 上下)
+            # 转置 (Z, W) 后上下+左右翻转 == 两轴都反向再转置
             idx = int(np.clip(idx, 0, self.data.shape[0] - 1))  # 固定前后方向
-            slice_2d = self.data[idx, :, :]  # (W, Z) = (左右, 上下)
-            # 转置使Z在垂直方向：(Z, W) = (上下, 左右)
-            transposed = slice_2d.T
-            # 用户说方向是对的但上下被压缩
-            # 保持Z在垂直方向，即使它维度较小
-            rotated = transposed
-            
-            # 上下翻转以修正方向
-            flipped_ud = np.flipud(rotated)
-            # 左右翻转
-            flipped_lr = np.fliplr(flipped_ud)
-            return flipped_lr
-    
+            view = self.data[idx, ::-1, ::-1].T
+        return view
+
     def get_slice_shape(self, orientation: ViewOrientation = ViewOrientation.AXIAL) -> tuple[int, int]:
-        """获取指定方向切片的形状 (height, width)"""
+        """获取指定方向切片的形状 (height, width)，与 get_slice 的结果一致"""
         if self.data.ndim == 2:
             return tuple(self.data.shape)
         if orientation == ViewOrientation.AXIAL:
             # 横断面旋转90度后，形状从 (H, W) 变成 (W, H)
             return (self.data.shape[1], self.data.shape[0])
         elif orientation == ViewOrientation.CORONAL:
-            # 冠状面：转置后 (Z, H)，如果高度<宽度则旋转，最终形状取决于哪个维度更大
-            h, w = self.data.shape[2], self.data.shape[0]
-            return (max(h, w), min(h, w)) if h < w else (h, w)
+            # 冠状面：转置后 (Z, H)
+            return (self.data.shape[2], self.data.shape[0])
         else:  # SAGITTAL
-            # 矢状面：转置后 (Z, W)，如果高度<宽度则旋转
-            h, w = self.data.shape[2], self.data.shape[1]
-            return (max(h, w), min(h, w)) if h < w else (h, w)
+            # 矢状面：转置后 (Z, W)
+            return (self.data.shape[2], self.data.shape[1])
+
+
+def _read_data(img: nib.spatialimages.SpatialImage) -> np.ndarray:
+    """读取体数据，尽量不整体展开成 float32
+
+    无缩放的整数/float32 数据直接使用磁盘上的原始类型（未压缩 .nii 为 memmap，
+    不占内存；int16 等也只占 float32 的一半）。get_slice 返回原始类型的视图，
+    float32/uint8 转换在 normalize_to_uint8（norm_u8）中按切片完成。
+    其余情况（有 scl_slope/inter、float64 等）仍然整体转换为 float32。
+
+    注意：memmap 在 NiftiVolume 存活期间一直映射源 .nii 文件，Windows 上此时
+    无法覆盖或删除该文件。
+    """
+    proxy = img.dataobj
+    raw_dtype = np.dtype(img.get_data_dtype())
+    unscaled = (
+        nib.is_proxy(proxy)
+        and float(getattr(proxy, "slope", 1.0)) == 1.0
+        and float(getattr(proxy, "inter", 0.0)) == 0.0
+    )
+    if unscaled and (raw_dtype.kind in "iu" or raw_dtype == np.float32):
+        return np.asanyarray(proxy)
+    return img.get_fdata(dtype=np.float32)
 
 
 def load_nifti(path: str | Path) -> NiftiVolume:
     p = Path(path)
     img = nib.load(str(p))
-    data = img.get_fdata(dtype=np.float32)
+    data = _read_data(img)
 
     # Accept 2D, 3D. If 4D, take first volume.
     if data.ndim == 4:
@@ -118,14 +179,22 @@ def load_nifti(path: str | Path) -> NiftiVolume:
     if data.ndim not in (2, 3):
         raise ValueError(f"Unsupported NIfTI dimensions: {data.shape}")
 
-    return NiftiVolume(path=p, data=data, affine=img.affine, header=img.header)
+    vol = NiftiVolume(path=p, data=data, affine=img.affine, header=img.header)
+    vol._percentile_future = _PERCENTILE_POOL.submit(vol.precompute_percentiles)
+    return vol
 
 
 def save_mask_nifti(
     out_path: str | Path,
     mask: np.ndarray,
     reference: Optional[NiftiVolume],
+    compresslevel: Optional[int] = None,
 ) -> None:
+    """保存 uint8 mask
+
+    compresslevel: .nii.gz 的 gzip 压缩级别；None 时使用 nibabel 的默认值（5.x 中为 1）。
+        两种方式都通过 nibabel 的 Opener 写出确定性的 gzip 头 (mtime=0)，同一 mask 保存结果逐字节相同。
+    """
     out_p = Path(out_path)
     out_p.parent.mkdir(parents=True, exist_ok=True)
 
@@ -137,6 +206,11 @@ def save_mask_nifti(
         header = nib.Nifti1Header()
 
     header.set_data_dtype(np.uint8)
-    img = nib.Nifti1Image(mask.astype(np.uint8), affine=affine, header=header)
-    nib.save(img, str(out_p))
+    # 已是 C 连续 uint8 时不再拷贝整个 mask
+    img = nib.Nifti1Image(np.ascontiguousarray(mask, dtype=np.uint8), affine=affine, header=header)
+    if compresslevel is not None and out_p.name.endswith(".gz"):
+        with Opener(out_p, "wb", compresslevel=compresslevel) as f:
+            img.to_file_map({"image": nib.FileHolder(fileobj=f)})
+    else:
+        nib.save(img, str(out_p))
 
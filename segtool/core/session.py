@@ -1,15 +1,44 @@
 from __future__ import annotations
 
-from dataclasses import dataclass, field
+import json
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
-from typing import Literal, Optional
+from typing import Callable, Literal, Optional
 
 import numpy as np
 
+# orjson is optional (requirements-fast.txt): it serializes dataclasses/enums in C without asdict().
+try:
+    import orjson
+except Exception:  # pragma: no cover
+    orjson = None
+
+from ._kernels import paint_label
 from .nifti_io import NiftiVolume, ViewOrientation
 
 Side = Literal["left", "right"]
 
+# 每个方向固定的体数据轴
+_SLICE_AXIS: dict[ViewOrientation, int] = {
+    ViewOrientation.AXIAL: 2,
+    ViewOrientation.CORONAL: 1,
+    ViewOrientation.SAGITTAL: 0,
+}
+
+# 显示切片 -> 存储切片 的逆变换（与 NiftiVolume.get_slice 相反），只返回视图不拷贝
+_DISPLAY_TO_STORAGE: dict[ViewOrientation, Callable[[np.ndarray], np.ndarray]] = {
+    ViewOrientation.AXIAL: lambda m: m[:, ::-1].T,  # 逆 rot90(k=-1)
+    ViewOrientation.CORONAL: lambda m: m.T[:, ::-1],  # 逆 转置+上下翻转
+    ViewOrientation.SAGITTAL: lambda m: m.T[::-1, ::-1],  # 逆 转置+上下+左右翻转
+}
+
+# 整个3D mask -> 按显示方向排列的切片栈 (n_slices, H_disp, W_disp)，stack[idx] == 显示切片
+_DISPLAY_STACK: dict[ViewOrientation, Callable[[np.ndarray], np.ndarray]] = {
+    ViewOrientation.AXIAL: lambda m: m.transpose(2, 1, 0)[:, :, ::-1],
+    ViewOrientation.CORONAL: lambda m: m.transpose(1, 2, 0)[:, ::-1, :],
+    ViewOrientation.SAGITTAL: lambda m: m.transpose(0, 2, 1)[:, ::-1, ::-1],
+}
+
 
 @dataclass
 class BoxAnnotation:
@@ -21,17 +50,44 @@ class BoxAnnotation:
     box_xyxy: tuple[int, int, int, int]
 
 
+def dump_boxes_json(boxes: list[BoxAnnotation]) -> bytes:
+    """将框标注序列化为 UTF-8 JSON（缩进2，orientation 保存为字符串值）"""
+    if orjson is not None:
+        # orjson 3 serializes dataclasses and str-Enum members (as their value) natively
+        return orjson.dumps(boxes, option=orjson.OPT_INDENT_2)
+
+    payload = []
+    for b in boxes:
+        d = asdict(b)
+        # Convert ViewOrientation enum to string value for JSON
+        if isinstance(d.get("orientation"), ViewOrientation):
+            d["orientation"] = d["orientation"].value
+        payload.append(d)
+    return json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
+
+
 @dataclass
 class ImageState:
     side: Side
     volume: Optional[NiftiVolume] = None
-    mask: Optional[np.ndarray] = None  # uint8, shape matches volume (2D or 3D)
+    mask: Optional[np.ndarray] = None  # uint8, shape matches volume (2D or 3D); None until first painted
     boxes: list[BoxAnnotation] = field(default_factory=list)
+    base_name: str = ""  # 输出文件名主干（原文件名去掉 .nii/.nii.gz），加载时计算一次
+
+    # 按方向缓存的连续切片栈（见 _mask_view），矢状/冠状切片读取也是顺序访问
+    _mask_views: dict[ViewOrientation, np.ndarray] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+    _mask_views_of: Optional[np.ndarray] = field(default=None, init=False, repr=False, compare=False)
 
     def clear(self) -> None:
+        if self.volume is not None:
+            self.volume.cancel_background()
         self.volume = None
         self.mask = None
         self.boxes.clear()
+        self.base_name = ""
+        self.invalidate_mask_views()
 
     def ensure_mask(self) -> None:
         if self.volume is None:
@@ -39,34 +95,48 @@ class ImageState:
         if self.mask is None or self.mask.shape != self.volume.data.shape:
             self.mask = np.zeros(self.volume.data.shape, dtype=np.uint8)
 
+    def clear_mask(self) -> None:
+        """清空 mask；已分配且形状匹配时原地置零复用内存，否则释放等待下次按需分配"""
+        if (
+            self.volume is not None
+            and self.mask is not None
+            and self.mask.shape == self.volume.data.shape
+            and self.mask.dtype == np.uint8
+        ):
+            self.mask.fill(0)
+            if self._mask_views_of is self.mask:
+                for view in self._mask_views.values():
+                    view.fill(0)
+            return
+        self.mask = None
+        self.invalidate_mask_views()
+
+    def invalidate_mask_views(self) -> None:
+        """mask 在 apply_slice_mask 以外被原地修改后需要调用"""
+        self._mask_views.clear()
+        self._mask_views_of = None
+
+    def _mask_view(self, orientation: ViewOrientation) -> np.ndarray:
+        assert self.mask is not None
+        if self._mask_views_of is not self.mask:  # mask 被整体替换
+            self.invalidate_mask_views()
+            self._mask_views_of = self.mask
+        view = self._mask_views.get(orientation)
+        if view is None:
+            view = np.ascontiguousarray(_DISPLAY_STACK[orientation](self.mask))
+            self._mask_views[orientation] = view
+        return view
+
     def get_mask_slice(self, idx: int, orientation: ViewOrientation = ViewOrientation.AXIAL) -> Optional[np.ndarray]:
-        """获取指定方向和索引的mask切片"""
+        """获取指定方向和索引的mask切片（只读，与 NiftiVolume.get_slice 方向一致）"""
         if self.mask is None:
             return None
         if self.mask.ndim == 2:
             return self.mask
-        
-        if orientation == ViewOrientation.AXIAL:
-            idx = int(np.clip(idx, 0, self.mask.shape[2] - 1))
-            slice_2d = self.mask[:, :, idx]  # (H, W)
-            # 旋转90度以匹配图像显示
-            return np.rot90(slice_2d, k=-1)
-        elif orientation == ViewOrientation.CORONAL:
-            # 冠状面：data[:, idx, :]，转置+翻转
-            idx = int(np.clip(idx, 0, self.mask.shape[1] - 1))
-            slice_2d = self.mask[:, idx, :]  # (H, Z) = (前后, 上下)
-            transposed = slice_2d.T  # (Z, H) = (上下, 前后)
-            # 上下翻转以匹配图像显示
-            return np.flipud(transposed)
-        else:  # SAGITTAL (需要转置+翻转以匹配图像显示)
-            # 矢状面：data[idx, :, :]，转置+翻转
-            idx = int(np.clip(idx, 0, self.mask.shape[0] - 1))
-            slice_2d = self.mask[idx, :, :]  # (W, Z) = (左右, 上下)
-            transposed = slice_2d.T  # (Z, W) = (上下, 左右)
-            # 上下和左右翻转以匹配图像显示
-            flipped_ud = np.flipud(transposed)
-            flipped_lr = np.fliplr(flipped_ud)
-            return flipped_lr
+
+        view = self._mask_view(orientation)
+        idx = int(np.clip(idx, 0, view.shape[0] - 1))
+        return view[idx]
 
     def apply_slice_mask(
         self, idx: int, slice_mask_bool: np.ndarray, label_value: int, 
@@ -85,30 +155,21 @@ class ImageState:
             self.mask[slice_mask_bool] = np.uint8(label_value)
             return
 
-        if orientation == ViewOrientation.AXIAL:
-            idx = int(np.clip(idx, 0, self.mask.shape[2] - 1))
-            sl = self.mask[:, :, idx]  # (H, W)
-            # slice_mask_bool 是旋转后的，需要逆旋转回来
-            mask_rotated_back = np.rot90(slice_mask_bool, k=1)  # 逆旋转（k=1是逆时针90度）
-            sl[mask_rotated_back] = np.uint8(label_value)
-            self.mask[:, :, idx] = sl
-        elif orientation == ViewOrientation.CORONAL:
-            idx = int(np.clip(idx, 0, self.mask.shape[1] - 1))
-            sl = self.mask[:, idx, :]  # (H, Z)
-            # slice_mask_bool 已经经过转置+上下翻转，需要逆处理
-            mask_flipped_ud = np.flipud(slice_mask_bool)  # 逆上下翻转
-            mask_final = mask_flipped_ud.T  # 转置回 (H, Z)
-            sl[mask_final] = np.uint8(label_value)
-            self.mask[:, idx, :] = sl
-        else:  # SAGITTAL
-            idx = int(np.clip(idx, 0, self.mask.shape[0] - 1))
-            sl = self.mask[idx, :, :]  # (W, Z)
-            # slice_mask_bool 已经经过转置+上下翻转+左右翻转，需要逆处理
-            mask_flipped_lr = np.fliplr(slice_mask_bool)  # 逆左右翻转
-            mask_flipped_ud = np.flipud(mask_flipped_lr)  # 逆上下翻转
-            mask_final = mask_flipped_ud.T  # 转置回 (W, Z)
-            sl[mask_final] = np.uint8(label_value)
-            self.mask[idx, :, :] = sl
+        # 目标切片是 self.mask 的视图；显示方向的 mask 经逆变换（同样是视图）后直接写入
+        axis = _SLICE_AXIS[orientation]
+        idx = int(np.clip(idx, 0, self.mask.shape[axis] - 1))
+        index: list[object] = [slice(None)] * 3
+        index[axis] = idx
+        sl = self.mask[tuple(index)]
+        paint_label(sl, _DISPLAY_TO_STORAGE[orientation](slice_mask_bool), label_value)
+
+        # 当前方向的缓存切片直接同步更新；其它方向的缓存失效，下次读取时重建
+        if self._mask_views_of is self.mask:
+            view = self._mask_views.get(orientation)
+            self._mask_views.clear()
+            if view is not None:
+                paint_label(view[idx], slice_mask_bool, label_value)
+                self._mask_views[orientation] = view
 
 
 @dataclass
@@ -1,11 +1,16 @@
 from __future__ import annotations
 
+import contextlib
+import hashlib
+from collections import OrderedDict
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
 
 import numpy as np
 
+_EMBEDDING_CACHE_SIZE = 8  # image embeddings kept per engine (one per recently used slice)
+
 
 @dataclass
 class SamConfig:
@@ -23,6 +28,14 @@ class SamEngine:
     def __init__(self) -> None:
         self._predictor = None
         self._cfg: Optional[SamConfig] = None
+        # key of the image currently embedded in the predictor, plus an LRU of
+        # recent embeddings (see set_image_cached)
+        self._image_key: Optional[tuple] = None
+        self._embeddings: OrderedDict[tuple, tuple] = OrderedDict()
+        # bumped by every load(); part of every cache key so embeddings from a
+        # previous model can never be restored into the new predictor
+        self._load_generation = 0
+        self._autocast_dtype = None  # torch dtype for CUDA autocast, None = full FP32
 
     @property
     def is_ready(self) -> bool:
@@ -51,41 +64,140 @@ class SamEngine:
 
         sam = sam_model_registry[cfg.model_type](checkpoint=str(cfg.checkpoint_path))
         sam.to(device=device)
+        sam.eval()
+
+        # FP16 autocast on Volta+ (sm>=70) GPUs; weights stay FP32 so SamPredictor's
+        # numpy conversions and mixed-dtype prompt ops keep working.
+        autocast_dtype = None
+        if device == "cuda" and torch.cuda.get_device_capability()[0] >= 7:
+            autocast_dtype = torch.float16
+
         self._predictor = SamPredictor(sam)
+        self._load_generation += 1
+        self._image_key = None
+        self._embeddings.clear()
+        self._autocast_dtype = autocast_dtype
         self._cfg = SamConfig(
             checkpoint_path=cfg.checkpoint_path,
             model_type=cfg.model_type,
             device=device,
         )
 
+    def set_image_cached(self, cache_key: Optional[tuple], image_rgb_u8: np.ndarray) -> None:
+        """
+        Embed the image, reusing a cached embedding when this image was encoded recently.
+        cache_key: caller identity for the image, e.g. (side, slice_idx, orientation, id(volume));
+            the load generation, image shape and a digest of its pixels are always part of the key too.
+        """
+        pred = self._predictor
+        if pred is None:
+            raise RuntimeError("SAM 尚未加载 checkpoint。")
+        generation = self._load_generation
+
+        img = np.ascontiguousarray(image_rgb_u8)
+        digest = hashlib.blake2b(img, digest_size=16).digest()
+        key = (generation, cache_key, img.shape, digest)
+        if key == self._image_key:
+            return
+
+        self._image_key = None
+        hit = self._embeddings.get(key)
+        if hit is not None:
+            self._embeddings.move_to_end(key)
+            pred.features, pred.original_size, pred.input_size = hit
+            pred.is_image_set = True
+        else:
+            with self._inference():
+                pred.set_image(img)
+            if generation != self._load_generation:
+                return  # load() replaced the predictor meanwhile; don't cache the old model's features
+            self._embeddings[key] = (pred.features, pred.original_size, pred.input_size)
+            while len(self._embeddings) > _EMBEDDING_CACHE_SIZE:
+                self._embeddings.popitem(last=False)
+        self._image_key = key
+
     def predict_mask_from_box(
         self,
         image_rgb_u8: np.ndarray,
         box_xyxy: tuple[int, int, int, int],
+        cache_key: Optional[tuple] = None,
     ) -> np.ndarray:
         """
         image_rgb_u8: (H,W,3) uint8
         box_xyxy: (x0,y0,x1,y1) in pixel coords, inclusive/exclusive doesn't matter much.
+        cache_key: see set_image_cached; boxes on a recently encoded image skip the encoder.
         returns: (H,W) bool mask
         """
         if self._predictor is None:
             raise RuntimeError("SAM 尚未加载 checkpoint。")
 
         pred = self._predictor
-        pred.set_image(image_rgb_u8)
+        self.set_image_cached(cache_key, image_rgb_u8)
 
         x0, y0, x1, y1 = box_xyxy
         box = np.array([x0, y0, x1, y1], dtype=np.float32)
-        masks, scores, _logits = pred.predict(
-            box=box[None, :],
-            multimask_output=False,
-        )
+        with self._inference():
+            masks, scores, _logits = pred.predict(
+                box=box[None, :],
+                multimask_output=False,
+            )
         _ = scores
         return masks[0].astype(bool)
 
+    def predict_masks_from_boxes(
+        self,
+        image_rgb_u8: np.ndarray,
+        boxes_xyxy: list[tuple[int, int, int, int]],
+        cache_key: Optional[tuple] = None,
+    ) -> list[np.ndarray]:
+        """
+        Batched version of predict_mask_from_box: one encoder pass (or cache hit) and a
+        single mask-decoder call for all boxes.
+        returns: one (H,W) bool mask per box, in order
+        """
+        if self._predictor is None:
+            raise RuntimeError("SAM 尚未加载 checkpoint。")
+        if not boxes_xyxy:
+            return []
+        if len(boxes_xyxy) == 1:
+            return [self.predict_mask_from_box(image_rgb_u8, boxes_xyxy[0], cache_key=cache_key)]
+
+        import torch
+
+        pred = self._predictor
+        self.set_image_cached(cache_key, image_rgb_u8)
+
+        boxes = torch.as_tensor(np.asarray(boxes_xyxy, dtype=np.float32), device=pred.device)
+        boxes = pred.transform.apply_boxes_torch(boxes, pred.original_size)
+        with self._inference():
+            masks, _scores, _logits = pred.predict_torch(
+                point_coords=None,
+                point_labels=None,
+                boxes=boxes,
+                multimask_output=False,
+            )
+        masks_np = masks[:, 0].cpu().numpy().astype(bool)
+        return list(masks_np)
+
+    @contextlib.contextmanager
+    def _inference(self) -> Iterator[None]:
+        """inference_mode (no autograd/version tracking), plus FP16 autocast when enabled."""
+        import torch
+
+        # both contexts are entered inside the with, so a failing autocast still exits inference_mode
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(torch.inference_mode())
+            if self._autocast_dtype is not None:
+                stack.enter_context(torch.autocast("cuda", dtype=self._autocast_dtype))
+            yield
+
 
 def ensure_rgb_from_gray_u8(gray_u8: np.ndarray) -> np.ndarray:
     if gray_u8.ndim != 2:
         raise ValueError(f"Expected 2D grayscale, got {gray_u8.shape}")
-    return np.stack([gray_u8, gray_u8, gray_u8], axis=-1)
+    # SamPredictor (PIL resize) and the embedding digest need a contiguous buffer, so a
+    # broadcast view is not enough; fill one preallocated (H,W,3) array in a single pass.
+    out = np.empty(gray_u8.shape + (3,), dtype=np.uint8)
+    out[...] = gray_u8[..., None]
+    return out
 
@@ -20,54 +20,91 @@ class Box:
 
 class ImageCanvas(QtWidgets.QWidget):
     boxDrawn = QtCore.Signal(object)  # Box in image coords
+    resized = QtCore.Signal()
 
     def __init__(self, parent: Optional[QtWidgets.QWidget] = None) -> None:
         super().__init__(parent)
         self.setMouseTracking(True)
 
-        self._img_rgb: Optional[np.ndarray] = None  # (H,W,3) uint8
-        self._pixmap: Optional[QtGui.QPixmap] = None
-        self._pixmap_rect = QtCore.QRectF()
+        self._img_rgb: Optional[np.ndarray] = None  # (H,W,3) or grayscale (H,W) uint8
+        # (H,W) of the full-resolution slice; _img_rgb may be a downsampled preview of it
+        self._source_shape: tuple[int, int] = (0, 0)
+        # QImage wraps _img_rgb's buffer directly (no copy); _img_rgb keeps it alive
+        self._qimage: Optional[QtGui.QImage] = None
+        self._image_rect = QtCore.QRectF()
+        # image pre-scaled to the last target size, so repaints (box dragging etc.) are plain blits
+        self._scaled: Optional[tuple[QtCore.QSize, QtGui.QPixmap]] = None
+        # fast scaling while the widget is being resized; smooth once resizing settles
+        self._fast_scaling = False
+        self._resize_timer = QtCore.QTimer(self)
+        self._resize_timer.setSingleShot(True)
+        self._resize_timer.setInterval(150)
+        self._resize_timer.timeout.connect(self._on_resize_settled)
 
         self._dragging = False
         self._drag_start: Optional[QtCore.QPointF] = None
         self._drag_end: Optional[QtCore.QPointF] = None
 
-    def set_image_rgb(self, img_rgb: np.ndarray) -> None:
+    def set_image_rgb(self, img_rgb: np.ndarray, source_shape: Optional[tuple[int, int]] = None) -> None:
+        """
+        img_rgb: (H,W,3) or (H,W) uint8
+        source_shape: full-resolution (H,W) when img_rgb is a downsampled preview;
+            boxes are always reported in source coordinates.
+        """
         self._img_rgb = np.ascontiguousarray(img_rgb, dtype=np.uint8)
-        h, w, _c = self._img_rgb.shape
-        qimg = QtGui.QImage(
+        h, w = self._img_rgb.shape[:2]
+        self._source_shape = (int(source_shape[0]), int(source_shape[1])) if source_shape else (h, w)
+        if self._img_rgb.ndim == 2:
+            fmt = QtGui.QImage.Format.Format_Grayscale8
+        else:
+            fmt = QtGui.QImage.Format.Format_RGB888
+        self._qimage = QtGui.QImage(
             self._img_rgb.data,
             w,
             h,
             int(self._img_rgb.strides[0]),
-            QtGui.QImage.Format.Format_RGB888,
+            fmt,
         )
-        self._pixmap = QtGui.QPixmap.fromImage(qimg.copy())
+        self._scaled = None
         # 保存原始宽高比
-        self._aspect_ratio = w / h if h > 0 else 1.0
+        src_h, src_w = self._source_shape
+        self._aspect_ratio = src_w / src_h if src_h > 0 else 1.0
         self.update()
 
     def clear(self) -> None:
+        self._qimage = None
+        self._scaled = None
         self._img_rgb = None
-        self._pixmap = None
         self._dragging = False
         self._drag_start = None
         self._drag_end = None
         self.update()
 
+    def resizeEvent(self, event: QtGui.QResizeEvent) -> None:
+        super().resizeEvent(event)
+        self._scaled = None
+        self._fast_scaling = True
+        self._resize_timer.start()
+        self.resized.emit()
+
+    def _on_resize_settled(self) -> None:
+        self._fast_scaling = False
+        self._scaled = None
+        self.update()
+
     def paintEvent(self, event: QtGui.QPaintEvent) -> None:  # noqa: ARG002
         p = QtGui.QPainter(self)
         p.fillRect(self.rect(), QtGui.QColor(20, 20, 20))
 
-        if self._pixmap is None:
+        if self._qimage is None:
             p.setPen(QtGui.QPen(QtGui.QColor(180, 180, 180)))
             p.drawText(self.rect(), QtCore.Qt.AlignmentFlag.AlignCenter, "No image")
             return
 
-        # Fit pixmap keeping aspect ratio
+        # Fit image keeping aspect ratio
         r = QtCore.QRectF(self.rect())
-        pm_size = QtCore.QSizeF(self._pixmap.size())
+        src_h, src_w = self._source_shape
+        pm_size = QtCore.QSizeF(src_w, src_h)
         # 检查是否是矢状位或冠状位（可能需要特殊处理）
         # 对于矢状位和冠状位，如果垂直方向应该是长边但数据中较短，
         # 可能需要调整显示比例
@@ -75,9 +112,20 @@ class ImageCanvas(QtWidgets.QWidget):
         x = r.left() + (r.width() - pm_size.width()) / 2.0
         y = r.top() + (r.height() - pm_size.height()) / 2.0
         target = QtCore.QRectF(x, y, pm_size.width(), pm_size.height())
-        self._pixmap_rect = target
-
-        p.drawPixmap(target.toRect(), self._pixmap)
+        self._image_rect = target
+
+        target_rect = target.toRect()
+        if self._scaled is None or self._scaled[0] != target_rect.size():
+            mode = (
+                QtCore.Qt.TransformationMode.FastTransformation
+                if self._fast_scaling
+                else QtCore.Qt.TransformationMode.SmoothTransformation
+            )
+            scaled = self._qimage.scaled(
+                target_rect.size(), QtCore.Qt.AspectRatioMode.IgnoreAspectRatio, mode
+            )
+            self._scaled = (target_rect.size(), QtGui.QPixmap.fromImage(scaled))
+        p.drawPixmap(target_rect.topLeft(), self._scaled[1])
 
         # draw current drag rectangle (widget coords)
         if self._dragging and self._drag_start is not None and self._drag_end is not None:
@@ -91,7 +139,7 @@ class ImageCanvas(QtWidgets.QWidget):
     def mousePressEvent(self, event: QtGui.QMouseEvent) -> None:
         if event.button() != QtCore.Qt.MouseButton.LeftButton:
             return
-        if self._pixmap is None:
+        if self._qimage is None:
             return
         self._dragging = True
         self._drag_start = QtCore.QPointF(event.position())
@@ -118,17 +166,16 @@ class ImageCanvas(QtWidgets.QWidget):
             self.boxDrawn.emit(box)
 
     def _compute_box_image_coords(self) -> Optional[Box]:
-        if self._img_rgb is None or self._pixmap is None:
+        if self._img_rgb is None or self._qimage is None:
             return None
         if self._drag_start is None or self._drag_end is None:
             return None
 
-        rect_w = self._pixmap_rect
+        rect_w = self._image_rect
         if rect_w.isNull() or rect_w.width() <= 1 or rect_w.height() <= 1:
             return None
 
-        w_img = int(self._img_rgb.shape[1])
-        h_img = int(self._img_rgb.shape[0])
+        h_img, w_img = self._source_shape
 
         def to_img(pt: QtCore.QPointF) -> tuple[int, int]:
             x = (pt.x() - rect_w.left()) / rect_w.width()
@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from collections import OrderedDict
 from pathlib import Path
 from typing import Optional
 
@@ -7,11 +8,41 @@ import numpy as np
 from PySide6 import QtCore, QtWidgets
 
 from ..core.image_utils import compose_overlay_rgb, normalize_to_uint8
-from ..core.labels import LABELS
+from ..core.labels import LABEL_LUT
 from ..core.nifti_io import NiftiVolume, ViewOrientation
-from ..core.session import Side
+from ..core.session import ImageState, Side
 from .image_canvas import Box, ImageCanvas
 
+_CACHE_SIZE = 64  # max cached slices per panel
+_PREFETCH_OFFSETS = (1, -1, 2, -2)  # neighbours pre-normalized while scrubbing
+
+
+def _render_base(vol: NiftiVolume, orientation: ViewOrientation, idx: int, stride: int) -> np.ndarray:
+    """归一化后的灰度切片（预览按 stride 降采样）"""
+    img2d = vol.get_slice(idx, orientation)[::stride, ::stride]
+    # 窗位取自全分辨率切片，预览与原图亮度一致
+    vrange = vol.slice_range(idx, orientation)
+    return normalize_to_uint8(img2d, vrange)
+
+
+class _PrefetchTask(QtCore.QRunnable):
+    """在线程池中预先归一化相邻切片并写入 ImagePanel 的灰度缓存"""
+
+    def __init__(self, panel: "ImagePanel", key: tuple, vol: NiftiVolume, generation: int) -> None:
+        super().__init__()
+        self._panel = panel
+        self._key = key
+        self._vol = vol
+        self._generation = generation
+
+    def run(self) -> None:
+        _vol_id, orientation, idx, stride = self._key
+        try:
+            base_u8 = _render_base(self._vol, orientation, idx, stride)
+        except Exception:  # noqa: BLE001
+            base_u8 = None
+        self._panel._finish_prefetch(self._key, self._generation, base_u8)
+
 
 class ImagePanel(QtWidgets.QWidget):
     boxDrawn = QtCore.Signal(str, int, object)  # side, slice_idx, Box
@@ -21,10 +52,26 @@ class ImagePanel(QtWidgets.QWidget):
         super().__init__(parent)
         self.side: Side = side
         self._volume: Optional[NiftiVolume] = None
-        self._mask: Optional[np.ndarray] = None
+        self._mask_state: Optional[ImageState] = None
         self._slice_idx: int = 0
         self._orientation: ViewOrientation = ViewOrientation.AXIAL
 
+        # LRU caches for rendered slices. The grayscale base only depends on
+        # (volume, orientation, slice); the composed RGB also on the mask version.
+        self._mask_version: int = 0
+        self._base_cache: OrderedDict[tuple, np.ndarray] = OrderedDict()
+        self._rgb_cache: OrderedDict[tuple, np.ndarray] = OrderedDict()
+        # 预览降采样步长（切片远大于画布时只渲染显示所需的像素；SAM/保存始终使用全分辨率）
+        self._stride: int = 1
+
+        # 相邻切片预取：线程池 + 互斥锁保护 _base_cache；方向/体数据变化时 generation 递增，
+        # 过期任务的结果会被丢弃
+        self._prefetch_pool = QtCore.QThreadPool(self)
+        self._prefetch_pool.setMaxThreadCount(2)
+        self._cache_lock = QtCore.QMutex()
+        self._prefetch_inflight: set[tuple] = set()
+        self._prefetch_generation: int = 0
+
         self.title_label = QtWidgets.QLabel(title)
         self.path_label = QtWidgets.QLabel("")
         self.path_label.setWordWrap(True)
@@ -60,6 +107,7 @@ class ImagePanel(QtWidgets.QWidget):
 
         self.slider.valueChanged.connect(self._on_slider_changed)
         self.canvas.boxDrawn.connect(self._on_box_drawn)
+        self.canvas.resized.connect(self._on_canvas_resized)
     
     @property
     def orientation(self) -> ViewOrientation:
@@ -75,7 +123,12 @@ class ImagePanel(QtWidgets.QWidget):
 
     def set_volume(self, vol: Optional[NiftiVolume]) -> None:
         self._volume = vol
-        self._mask = None
+        self._mask_state = None
+        self._mask_version += 1
+        self._cancel_prefetch()
+        with QtCore.QMutexLocker(self._cache_lock):
+            self._base_cache.clear()
+        self._rgb_cache.clear()
         self._slice_idx = 0
         self._orientation = ViewOrientation.AXIAL
 
@@ -109,6 +162,7 @@ class ImagePanel(QtWidgets.QWidget):
         """方向选择改变时的回调"""
         orientations = [ViewOrientation.AXIAL, ViewOrientation.CORONAL, ViewOrientation.SAGITTAL]
         self._orientation = orientations[index]
+        self._cancel_prefetch()
         if self._volume and self._volume.is_3d:
             self._update_slider_for_orientation()
         self._render()
@@ -126,51 +180,118 @@ class ImagePanel(QtWidgets.QWidget):
         self.slider.setValue(current_idx)
         self._slice_idx = current_idx
 
-    def set_mask(self, mask: Optional[np.ndarray]) -> None:
-        self._mask = mask
+    def set_mask(self, state: Optional[ImageState]) -> None:
+        """显示 state.mask；mask 可能被原地修改，所以每次调用都视为新的 mask"""
+        self._mask_state = state
+        self._mask_version += 1
+        self._rgb_cache.clear()
         self._render()
 
     def _on_slider_changed(self, v: int) -> None:
         self._slice_idx = int(v)
         self._render()
+        self._prefetch_neighbours()
         self.sliceChanged.emit(self.side, self._slice_idx)
 
+    def _prefetch_neighbours(self) -> None:
+        vol = self._volume
+        if vol is None or not vol.is_3d:
+            return
+        num_slices = vol.num_slices(self._orientation)
+        with QtCore.QMutexLocker(self._cache_lock):
+            for k in _PREFETCH_OFFSETS:
+                idx = self._slice_idx + k
+                if not 0 <= idx < num_slices:
+                    continue
+                key = (id(vol), self._orientation, idx, self._stride)
+                if key in self._base_cache or key in self._prefetch_inflight:
+                    continue
+                self._prefetch_inflight.add(key)
+                self._prefetch_pool.start(_PrefetchTask(self, key, vol, self._prefetch_generation))
+
+    def _finish_prefetch(self, key: tuple, generation: int, base_u8: Optional[np.ndarray]) -> None:
+        # 在线程池线程中调用
+        with QtCore.QMutexLocker(self._cache_lock):
+            self._prefetch_inflight.discard(key)
+            if base_u8 is not None and generation == self._prefetch_generation:
+                self._cache_put(self._base_cache, key, base_u8)
+
+    def _cancel_prefetch(self) -> None:
+        self._prefetch_pool.clear()  # 丢弃尚未开始的任务
+        with QtCore.QMutexLocker(self._cache_lock):
+            self._prefetch_generation += 1
+            self._prefetch_inflight.clear()
+
     def _on_box_drawn(self, box: Box) -> None:
         self.boxDrawn.emit(self.side, self._slice_idx, box)
 
-    def _render(self) -> None:
-        if self._volume is None:
-            return
+    def _on_canvas_resized(self) -> None:
+        if self._volume is not None and self._display_stride() != self._stride:
+            self._render()
+
+    def _display_stride(self) -> int:
+        """切片至少是画布的2倍大时，按整数步长降采样预览"""
+        if self._volume is None or not self.canvas.isVisible():
+            return 1
+        h, w = self._volume.get_slice_shape(self._orientation)
+        th = max(1, self.canvas.height())
+        tw = max(1, self.canvas.width())
+        return max(1, min(h // th, w // tw))
+
+    @staticmethod
+    def _cache_get(cache: OrderedDict[tuple, np.ndarray], key: tuple) -> Optional[np.ndarray]:
+        hit = cache.get(key)
+        if hit is not None:
+            cache.move_to_end(key)
+        return hit
+
+    @staticmethod
+    def _cache_put(cache: OrderedDict[tuple, np.ndarray], key: tuple, value: np.ndarray) -> None:
+        cache[key] = value
+        while len(cache) > _CACHE_SIZE:
+            cache.popitem(last=False)
+
+    def _cached_base(self) -> np.ndarray:
+        """归一化后的灰度切片（与mask无关，按切片缓存）"""
+        assert self._volume is not None
+        stride = self._stride
+        key = (id(self._volume), self._orientation, self._slice_idx, stride)
+        with QtCore.QMutexLocker(self._cache_lock):
+            base_u8 = self._cache_get(self._base_cache, key)
+        if base_u8 is None:
+            base_u8 = _render_base(self._volume, self._orientation, self._slice_idx, stride)
+            with QtCore.QMutexLocker(self._cache_lock):
+                self._cache_put(self._base_cache, key, base_u8)
+        return base_u8
+
+    def _cached_rgb(self) -> np.ndarray:
+        """叠加mask后的RGB切片，按 mask 版本失效"""
+        stride = self._stride
+        key = (id(self._volume), self._orientation, self._slice_idx, stride, self._mask_version)
+        rgb = self._cache_get(self._rgb_cache, key)
+        if rgb is not None:
+            return rgb
 
-        img2d = self._volume.get_slice(self._slice_idx, self._orientation)
-        base_u8 = normalize_to_uint8(img2d)
+        base_u8 = self._cached_base()
         
         # 获取对应方向的mask切片（使用 session 的方法，确保与图像显示一致）
         mask2d: Optional[np.ndarray] = None
-        if self._mask is not None:
-            if self._mask.ndim == 2:
-                mask2d = self._mask
-            else:
-                # 使用与图像相同的逻辑提取mask切片
-                if self._orientation == ViewOrientation.AXIAL:
-                    idx = int(np.clip(self._slice_idx, 0, self._mask.shape[2] - 1))
-                    slice_2d = self._mask[:, :, idx]  # (H, W)
-                    mask2d = np.rot90(slice_2d, k=-1)  # 旋转以匹配图像显示
-                elif self._orientation == ViewOrientation.CORONAL:
-                    idx = int(np.clip(self._slice_idx, 0, self._mask.shape[1] - 1))
-                    slice_2d = self._mask[:, idx, :]  # (H, Z) = (前后, 上下)
-                    transposed = slice_2d.T  # (Z, H) = (上下, 前后)
-                    mask2d = np.flipud(transposed)  # 上下翻转以匹配图像显示
-                else:  # SAGITTAL (需要转置+翻转以匹配图像显示)
-                    idx = int(np.clip(self._slice_idx, 0, self._mask.shape[0] - 1))
-                    slice_2d = self._mask[idx, :, :]  # (W, Z) = (左右, 上下)
-                    transposed = slice_2d.T  # (Z, W) = (上下, 左右)
-                    flipped_ud = np.flipud(transposed)
-                    mask2d = np.fliplr(flipped_ud)  # 上下和左右翻转以匹配图像显示
-
-        label_to_rgb = {spec.value: spec.rgb for spec in LABELS.values()}
-        rgb = compose_overlay_rgb(base_u8, mask2d, label_to_rgb=label_to_rgb, alpha=0.4)
-        self.canvas.set_image_rgb(rgb)
+        if self._mask_state is not None:
+            mask2d = self._mask_state.get_mask_slice(self._slice_idx, self._orientation)
+            if mask2d is not None:
+                mask2d = mask2d[::stride, ::stride]
+
+        rgb = compose_overlay_rgb(base_u8, mask2d, LABEL_LUT, alpha=0.4)
+        self._cache_put(self._rgb_cache, key, rgb)
+        return rgb
+
+    def _render(self) -> None:
+        if self._volume is None:
+            return
+
+        self._stride = self._display_stride()
+        rgb = self._cached_rgb()
+        self.canvas.set_image_rgb(rgb, source_shape=self._volume.get_slice_shape(self._orientation))
 
         num_slices = self._volume.num_slices(self._orientation)
         if num_slices == 1:
@@ -1,59 +1,111 @@
 from __future__ import annotations
 
-import json
-from dataclasses import asdict
 from pathlib import Path
 from typing import Optional
 
 import numpy as np
 from PySide6 import QtCore, QtGui, QtWidgets
 
+from ..core.image_utils import normalize_to_uint8
 from ..core.labels import LABELS, LabelSpec
-from ..core.nifti_io import load_nifti, save_mask_nifti, ViewOrientation
-from ..core.session import AppState, BoxAnnotation, ImageState, Side
+from ..core.nifti_io import NiftiVolume, load_nifti, save_mask_nifti, ViewOrientation
+from ..core.session import AppState, BoxAnnotation, ImageState, Side, dump_boxes_json
 from ..sam.engine import SamConfig, SamEngine, ensure_rgb_from_gray_u8
 from .image_panel import ImagePanel
 
 
-class _SamJob(QtCore.QObject):
-    finished = QtCore.Signal(str, int, object, object)  # side, slice_idx, mask_bool, err_or_none
+def _build_label_stylesheet() -> str:
+    rules = [
+        "QRadioButton::indicator { width: 16px; height: 16px; }",
+        "QRadioButton { padding: 2px 4px; border-radius: 3px; }",
+    ]
+    for key, spec in LABELS.items():
+        r, g, b = spec.rgb
+        rules.append(f'QRadioButton[labelkey="{key}"] {{ background-color: rgb({r}, {g}, {b}); }}')
+    return "\n".join(rules)
 
-    def __init__(
-        self,
-        engine: SamEngine,
-        image_rgb_u8: np.ndarray,
-        side: Side,
-        slice_idx: int,
-        box_xyxy: tuple[int, int, int, int],
-    ) -> None:
+
+# 所有标签按钮共用一个样式表（Qt 只解析一次），按 labelkey 属性设置背景色
+_LABEL_STYLESHEET = _build_label_stylesheet()
+
+
+class _SamWorker(QtCore.QObject):
+    """常驻在 SAM 线程中的 worker；任务通过排队信号提交，按顺序执行"""
+
+    finished = QtCore.Signal(str, int, object, object)  # side, slice_idx, list[mask_bool], err_or_none
+
+    def __init__(self, engine: SamEngine) -> None:
         super().__init__()
         self._engine = engine
-        self._img = image_rgb_u8
+
+    @QtCore.Slot(object)
+    def run(self, job: dict) -> None:
+        side, slice_idx = job["side"], job["slice_idx"]
+        try:
+            # 归一化和灰度转RGB也在 SAM 线程里做，不占用 GUI 线程；
+            # norm_u8 的 numba kernel 是串行的，可与 GUI/预取线程同时调用
+            gray_u8 = normalize_to_uint8(job["img2d"], job["vrange"])
+            rgb_u8 = ensure_rgb_from_gray_u8(gray_u8)
+            masks = self._engine.predict_masks_from_boxes(rgb_u8, job["boxes"], cache_key=job["cache_key"])
+            self.finished.emit(side, slice_idx, masks, None)
+        except Exception as e:  # noqa: BLE001
+            self.finished.emit(side, slice_idx, None, str(e))
+
+
+class _LoadSignals(QtCore.QObject):
+    done = QtCore.Signal(str, str, object, object)  # side, path, NiftiVolume, err_or_none
+
+
+class _LoadTask(QtCore.QRunnable):
+    """在线程池中读取/解压 NIfTI，完成后通过 _LoadSignals 回到 GUI 线程"""
+
+    def __init__(self, side: Side, path: str, signals: _LoadSignals) -> None:
+        super().__init__()
         self._side = side
-        self._slice_idx = slice_idx
-        self._box = box_xyxy
+        self._path = path
+        self._signals = signals
 
-    @QtCore.Slot()
     def run(self) -> None:
         try:
-            m = self._engine.predict_mask_from_box(self._img, self._box)
-            self.finished.emit(self._side, self._slice_idx, m, None)
+            vol = load_nifti(self._path)
+            self._signals.done.emit(self._side, self._path, vol, None)
         except Exception as e:  # noqa: BLE001
-            self.finished.emit(self._side, self._slice_idx, None, str(e))
+            self._signals.done.emit(self._side, self._path, None, str(e))
 
 
 class MainWindow(QtWidgets.QMainWindow):
+    _samSubmit = QtCore.Signal(object)  # job dict for _SamWorker.run
+    # logo.png 很大 (3304x1038)，解码+缩放一次后所有窗口共用
+    _logo_pixmap: Optional[QtGui.QPixmap] = None
+
     def __init__(self) -> None:
         super().__init__()
         self.setWindowTitle("Spine Data segtool V-1.0")
 
         self.state = AppState()
         self.sam = SamEngine()
-        self._sam_thread: Optional[QtCore.QThread] = None
         self._sam_busy = False
+        # 单个常驻 SAM 线程（CUDA 上下文/分配器保持热状态），不再每个任务新建 QThread
+        self._sam_thread = QtCore.QThread(self)
+        self._sam_worker = _SamWorker(self.sam)
+        self._sam_worker.moveToThread(self._sam_thread)
+        self._samSubmit.connect(self._sam_worker.run)
+        self._sam_worker.finished.connect(self._on_sam_finished)
+        self._sam_thread.start()
+        # 正在执行的批次：(items, orientation, generation)
+        self._sam_inflight: Optional[tuple[list[tuple[tuple[int, int, int, int], LabelSpec]], ViewOrientation, int]] = None
+        # 每侧的代数：加载/清除时递增，运行期间代数变化的 SAM 结果直接丢弃
+        self._generation: dict[Side, int] = {"left": 0, "right": 0}
+        # 等待执行的框，按 (side, slice_idx, orientation) 分组，同一切片的框合并为一次 SAM 调用
+        self._pending: dict[tuple[Side, int, ViewOrientation], list[tuple[tuple[int, int, int, int], LabelSpec]]] = {}
+        # 后台加载 NIfTI
+        self._load_signals = _LoadSignals(self)
+        self._load_signals.done.connect(self._on_volume_loaded)
 
         self.left_panel = ImagePanel(side="left", title="Left (X-ray)")
         self.right_panel = ImagePanel(side="right", title="Right (MRI)")
+        self._states: dict[Side, ImageState] = {"left": self.state.left, "right": self.state.right}
+        self._panels: dict[Side, ImagePanel] = {"left": self.left_panel, "right": self.right_panel}
         self.tools = self._build_tools_panel()
 
         splitter = QtWidgets.QSplitter(QtCore.Qt.Orientation.Horizontal)
@@ -85,6 +137,10 @@ class MainWindow(QtWidgets.QMainWindow):
         gl = QtWidgets.QVBoxLayout()
         self.btn_load_left = QtWidgets.QPushButton("Load Left (X-ray) .nii/.nii.gz")
         self.btn_load_right = QtWidgets.QPushButton("Load Right (MRI) .nii/.nii.gz")
+        self._load_buttons: dict[Side, QtWidgets.QPushButton] = {
+            "left": self.btn_load_left,
+            "right": self.btn_load_right,
+        }
         gl.addWidget(self.btn_load_left)
         gl.addWidget(self.btn_load_right)
         grp_load.setLayout(gl)
@@ -108,22 +164,13 @@ class MainWindow(QtWidgets.QMainWindow):
         label_layout.setSpacing(4)
         
         self.label_buttons: dict[str, QtWidgets.QRadioButton] = {}
+        self._active_label_key = "gray"  # 由 radio button 的 toggled 信号维护
         row, col = 0, 0
         for key, label_spec in sorted(LABELS.items(), key=lambda x: x[1].value):
             rb = QtWidgets.QRadioButton(label_spec.name)
-            # Set button color as background
-            color = QtGui.QColor(*label_spec.rgb)
-            rb.setStyleSheet(
-                f"QRadioButton::indicator {{"
-                f"  width: 16px;"
-                f"  height: 16px;"
-                f"}}"
-                f"QRadioButton {{"
-                f"  background-color: rgb({color.red()}, {color.green()}, {color.blue()});"
-                f"  padding: 2px 4px;"
-                f"  border-radius: 3px;"
-                f"}}"
-            )
+            # Button color comes from _LABEL_STYLESHEET via the labelkey property
+            rb.setProperty("labelkey", key)
+            rb.toggled.connect(lambda checked, k=key: self._set_active_label(k) if checked else None)
             self.label_buttons[key] = rb
             self.label_group.addButton(rb, label_spec.value)
             label_layout.addWidget(rb, row, col)
@@ -135,6 +182,7 @@ class MainWindow(QtWidgets.QMainWindow):
                 rb.setChecked(True)
         
         label_widget.setLayout(label_layout)
+        label_widget.setStyleSheet(_LABEL_STYLESHEET)
         scroll.setWidget(label_widget)
         glb.addWidget(scroll)
         grp_label.setLayout(glb)
@@ -207,13 +255,15 @@ class MainWindow(QtWidgets.QMainWindow):
         
         # Load and display logo
         logo_path = Path(__file__).parent.parent.parent / "logo.png"
-        if logo_path.exists():
-            logo_label = QtWidgets.QLabel()
+        if MainWindow._logo_pixmap is None and logo_path.exists():
             pixmap = QtGui.QPixmap(str(logo_path))
             # Scale logo to fit (max width 200px, maintain aspect ratio)
             if pixmap.width() > 200:
                 pixmap = pixmap.scaledToWidth(200, QtCore.Qt.TransformationMode.SmoothTransformation)
-            logo_label.setPixmap(pixmap)
+            MainWindow._logo_pixmap = pixmap
+        if MainWindow._logo_pixmap is not None:
+            logo_label = QtWidgets.QLabel()
+            logo_label.setPixmap(MainWindow._logo_pixmap)
             logo_label.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
             logo_layout.addWidget(logo_label)
         
@@ -238,19 +288,17 @@ class MainWindow(QtWidgets.QMainWindow):
         return w
 
     # -------------------- Helpers --------------------
+    def _set_active_label(self, key: str) -> None:
+        self._active_label_key = key
+
     def _current_label(self) -> LabelSpec:
-        # Find which radio button is checked
-        for key, rb in self.label_buttons.items():
-            if rb.isChecked():
-                return LABELS[key]
-        # Fallback to gray if none selected (should not happen)
-        return LABELS["gray"]
+        return LABELS[self._active_label_key]
 
     def _get_image_state(self, side: Side) -> ImageState:
-        return self.state.left if side == "left" else self.state.right
+        return self._states[side]
 
     def _get_panel(self, side: Side) -> ImagePanel:
-        return self.left_panel if side == "left" else self.right_panel
+        return self._panels[side]
 
     def _refresh_status(self, msg: Optional[str] = None) -> None:
         parts: list[str] = []
@@ -276,20 +324,39 @@ class MainWindow(QtWidgets.QMainWindow):
         )
         if not fn:
             return
-        try:
-            vol = load_nifti(fn)
-        except Exception as e:  # noqa: BLE001
-            self._message("Load failed", str(e))
+
+        # 解压/解码可能需要数秒，放到线程池中执行，期间禁用该侧的加载按钮
+        self._load_button(side).setEnabled(False)
+        self._refresh_status(f"Loading {side}: {fn} ...")
+        QtCore.QThreadPool.globalInstance().start(_LoadTask(side, fn, self._load_signals))
+
+    def _load_button(self, side: Side) -> QtWidgets.QPushButton:
+        return self._load_buttons[side]
+
+    def _on_volume_loaded(self, side_s: str, fn: str, vol: object, err: object) -> None:
+        side: Side = "left" if side_s == "left" else "right"
+        self._load_button(side).setEnabled(True)
+        if err is not None:
+            self._refresh_status(f"Load failed: {side}")
+            self._message("Load failed", str(err))
             return
+        assert isinstance(vol, NiftiVolume)
 
         st = self._get_image_state(side)
+        self._drop_pending(side)
+        self._generation[side] += 1
+        if st.volume is not None:
+            st.volume.cancel_background()  # 旧体数据的分位数已无用
         st.volume = vol
-        st.mask = np.zeros(vol.data.shape, dtype=np.uint8)
+        # 原始文件名（不含路径和扩展名）；.nii.gz 的 stem 仍带 .nii
+        base = vol.path.stem
+        st.base_name = base[:-4] if base.endswith(".nii") else base
+        st.mask = None  # 首次应用 SAM 结果时才分配（ImageState.ensure_mask）
         st.boxes.clear()
 
         panel = self._get_panel(side)
         panel.set_volume(vol)
-        panel.set_mask(st.mask)
+        panel.set_mask(st)
         self._refresh_status(f"Loaded {side}: {fn}")
 
     # -------------------- SAM --------------------
@@ -310,6 +377,10 @@ class MainWindow(QtWidgets.QMainWindow):
         if self.state.sam_checkpoint is None:
             self._message("SAM", "请先选择一个 SAM checkpoint (.pth)。")
             return
+        if self._sam_busy:
+            # SAM 线程正在使用当前模型，替换 predictor/embedding 缓存会与其冲突
+            self._refresh_status("SAM is busy; wait for the running batch before loading a model.")
+            return
         cfg = SamConfig(
             checkpoint_path=self.state.sam_checkpoint,
             model_type=self.combo_model.currentText(),
@@ -352,77 +423,114 @@ class MainWindow(QtWidgets.QMainWindow):
         if not self.sam.is_ready:
             self._refresh_status("Box recorded, but SAM not ready.")
             return
+
+        key = (side_t, int(slice_idx), orientation)
+        self._pending.setdefault(key, []).append((tuple(map(int, box_xyxy)), label))
         if self._sam_busy:
-            self._refresh_status("SAM busy; box recorded but not executed.")
+            n = sum(len(v) for v in self._pending.values())
+            self._refresh_status(f"SAM busy; box queued ({n} pending).")
             return
+        self._run_next_sam_batch()
+
+    def _drop_pending(self, side: Side) -> None:
+        for key in [k for k in self._pending if k[0] == side]:
+            del self._pending[key]
+
+    def _run_next_sam_batch(self) -> None:
+        """取出最早排队的一个切片，把它的所有框作为一批交给 SAM"""
+        while self._pending:
+            key = next(iter(self._pending))
+            items = self._pending.pop(key)
+            side, slice_idx, orientation = key
+            st = self._get_image_state(side)
+            if st.volume is None:
+                continue  # 该侧已被清除
 
-        # Prepare slice for SAM (使用当前方向)
-        img2d = st.volume.get_slice(int(slice_idx), orientation)
-        from ..core.image_utils import normalize_to_uint8  # local import to avoid cycles
-
-        gray_u8 = normalize_to_uint8(img2d)
-        rgb_u8 = ensure_rgb_from_gray_u8(gray_u8)
-        self._run_sam(side_t, int(slice_idx), rgb_u8, tuple(map(int, box_xyxy)), label, orientation)
+            self._run_sam(side, slice_idx, items, orientation)
+            return
 
     def _run_sam(
         self,
         side: Side,
         slice_idx: int,
-        image_rgb_u8: np.ndarray,
-        box_xyxy: tuple[int, int, int, int],
-        label: LabelSpec,
+        items: list[tuple[tuple[int, int, int, int], LabelSpec]],
         orientation: ViewOrientation = ViewOrientation.AXIAL,
     ) -> None:
         self._sam_busy = True
         orient_name = orientation.value
-        self._refresh_status(f"Running SAM on {side} slice {slice_idx} ({orient_name}) ...")
-
-        thread = QtCore.QThread(self)
-        job = _SamJob(self.sam, image_rgb_u8, side, slice_idx, box_xyxy)
-        job.moveToThread(thread)
-        thread.started.connect(job.run)
-
-        def _done(side_s: str, slice_i: int, mask_bool: object, err: object) -> None:
-            self._sam_busy = False
-            try:
-                if err is not None:
-                    self._refresh_status(f"SAM error: {err}")
-                    return
-
-                m = mask_bool  # type: ignore[assignment]
-                if m is None:
-                    self._refresh_status("SAM returned empty mask.")
-                    return
-
-                st = self._get_image_state(side_s)  # type: ignore[arg-type]
-                # 使用正确的方向应用mask
+        self._refresh_status(f"Running SAM on {side} slice {slice_idx} ({orient_name}), {len(items)} box(es) ...")
+
+        # 同一切片上的多个框复用 SAM 图像编码
+        st = self._get_image_state(side)
+        cache_key = (side, slice_idx, orientation.value, id(st.volume))
+
+        assert st.volume is not None
+        self._sam_inflight = (items, orientation, self._generation[side])
+        self._samSubmit.emit(
+            {
+                # 切片视图（不拷贝），归一化在 worker 中完成 (使用当前方向)
+                "img2d": st.volume.get_slice(slice_idx, orientation),
+                "vrange": st.volume.slice_range(slice_idx, orientation),
+                "side": side,
+                "slice_idx": slice_idx,
+                "boxes": [box for box, _label in items],
+                "cache_key": cache_key,
+            }
+        )
+
+    def _on_sam_finished(self, side_s: str, slice_i: int, masks: object, err: object) -> None:
+        assert self._sam_inflight is not None
+        items, orientation, generation = self._sam_inflight
+        self._sam_inflight = None
+        self._sam_busy = False
+        orient_name = orientation.value
+        try:
+            if err is not None:
+                self._refresh_status(f"SAM error: {err}")
+                return
+
+            if not masks:
+                self._refresh_status("SAM returned empty mask.")
+                return
+
+            st = self._get_image_state(side_s)  # type: ignore[arg-type]
+            if self._generation[side_s] != generation:  # type: ignore[index]
+                # 运行期间重新加载/清除了该侧
+                self._refresh_status(f"SAM result discarded ({side_s} reloaded or cleared).")
+                return
+            # 使用正确的方向应用mask（按框的先后顺序，后画的覆盖先画的）
+            for m, (_box, label) in zip(masks, items):  # type: ignore[call-overload]
                 st.apply_slice_mask(slice_i, np.asarray(m, dtype=bool), label.value, orientation)
-                self._get_panel(side_s).set_mask(st.mask)  # type: ignore[arg-type]
-                self._refresh_status(f"SAM done: {side_s} slice {slice_i} ({orient_name}), label={label.name}")
-            finally:
-                thread.quit()
-                thread.wait()
-                job.deleteLater()
-                thread.deleteLater()
-                self._sam_thread = None
-
-        job.finished.connect(_done)
-        self._sam_thread = thread
-        thread.start()
+            self._get_panel(side_s).set_mask(st)  # type: ignore[arg-type]
+            labels = ", ".join(label.name for _box, label in items)
+            self._refresh_status(f"SAM done: {side_s} slice {slice_i} ({orient_name}), label={labels}")
+        finally:
+            self._run_next_sam_batch()
+
+    def closeEvent(self, event: QtGui.QCloseEvent) -> None:
+        # 退出时 concurrent.futures 会 join 分位数线程，先让它尽快结束
+        for st in self._states.values():
+            if st.volume is not None:
+                st.volume.cancel_background()
+        self._sam_thread.quit()
+        self._sam_thread.wait()
+        super().closeEvent(event)
 
     # -------------------- Actions --------------------
     def _clear(self, side: Side) -> None:
         st = self._get_image_state(side)
         if st.volume is None:
             return
-        st.mask = np.zeros(st.volume.data.shape, dtype=np.uint8)
+        self._drop_pending(side)
+        self._generation[side] += 1  # 正在运行的批次结果不再写入
+        st.clear_mask()
         st.boxes.clear()
-        self._get_panel(side).set_mask(st.mask)
+        self._get_panel(side).set_mask(st)
         self._refresh_status(f"Cleared {side}.")
 
     def _undo(self, side: Side) -> None:
         st = self._get_image_state(side)
-        if st.volume is None or st.mask is None:
+        if st.volume is None:
             return
         if not st.boxes:
             self._refresh_status(f"No boxes to undo on {side}.")
@@ -449,29 +557,14 @@ class MainWindow(QtWidgets.QMainWindow):
             st.ensure_mask()
             assert st.mask is not None
 
-            # 获取原始文件名（不含路径和扩展名）
-            original_name = st.volume.path.stem
-            # 移除可能的 .nii 后缀（如果原始文件是 .nii.gz，stem 会包含 .nii）
-            if original_name.endswith('.nii'):
-                original_name = original_name[:-4]
-            
             # 添加前缀：左边加 "l"，右边加 "r"
-            prefix = "l" if side == "left" else "r"
-            base_name = f"{prefix}{original_name}"
+            base_name = f"{'l' if side == 'left' else 'r'}{st.base_name}"
 
             mask_path = out_p / f"{base_name}_mask.nii.gz"
             save_mask_nifti(mask_path, st.mask, reference=st.volume)
 
             boxes_path = out_p / f"{base_name}_boxes.json"
-            # Convert BoxAnnotation to dict, handling Enum serialization
-            payload = []
-            for b in st.boxes:
-                d = asdict(b)
-                # Convert ViewOrientation enum to string value for JSON
-                if isinstance(d.get("orientation"), ViewOrientation):
-                    d["orientation"] = d["orientation"].value
-                payload.append(d)
-            boxes_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2), encoding="utf-8")
+            boxes_path.write_bytes(dump_boxes_json(st.boxes))
             saved_any = True
 
         if not saved_any: